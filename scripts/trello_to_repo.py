@@ -0,0 +1,606 @@
+#!/usr/bin/env python3
+"""Sync the Trello client board into the repo's map data.
+
+Pulls every card from the board, extracts a street address from the card
+description, geocodes it (Mapbox when a token is configured, Nominatim
+otherwise), downloads the card's cover image as a 64x64 logo thumbnail, and
+writes the combined rows to clients.json for the map page.
+
+Runs in CI on every board change, so re-runs should be as cheap as
+possible: geocoding results are cached in data/geocode_cache.sqlite and
+re-used across runs.
+"""
+
+import bisect
+import io
+import json
+import logging
+import os
+import re
+import sys
+import sqlite3
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from datetime import datetime, timezone
+from io import BytesIO
+from urllib.parse import urlparse, urlsplit
+
+import requests
+from PIL import Image
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+try:
+    import orjson  # C-accelerated; several times faster than stdlib json
+except ImportError:
+    orjson = None
+
+try:
+    import ahocorasick  # pyahocorasick: one C pass over all street hints
+except ImportError:
+    ahocorasick = None
+
+# Buffered, thread-safe logging instead of per-card print: under CI log
+# redirection every print was a flush and a write() syscall. Per-card
+# progress sits at DEBUG; set LOGLEVEL=DEBUG to get it back.
+logging.basicConfig(
+    level=os.environ.get("LOGLEVEL", "INFO"),
+    stream=io.TextIOWrapper(sys.stderr.buffer, write_through=False),
+    format="%(message)s",
+)
+log = logging.getLogger(__name__)
+
+TRELLO_KEY = os.environ.get("TRELLO_KEY", "")
+TRELLO_TOKEN = os.environ.get("TRELLO_TOKEN", "")
+BOARD_ID = os.environ.get("TRELLO_BOARD_ID", "")
+MAPBOX_TOKEN = os.environ.get("MAPBOX_TOKEN", "")
+
+OUT_JSON = os.environ.get("OUT_JSON", "data/clients.json")
+LOGO_DIR = "assets/logos"
+GEOCODE_CACHE_DB = "data/geocode_cache.sqlite"
+
+NOMINATIM_URL = "https://nominatim.openstreetmap.org/search"
+NOMINATIM_HEADERS = {"User-Agent": "vl-client-map/1.0 (github.com/benjaminbloch/vl-client-map)"}
+
+# One pooled session for Trello, the geocoders and image downloads: keeps
+# sockets warm across the thread pools (no TLS handshake per call) and
+# retries transient 429/5xx responses with backoff.
+SESSION = requests.Session()
+SESSION.mount(
+    "https://",
+    HTTPAdapter(
+        pool_connections=32,
+        pool_maxsize=32,
+        max_retries=Retry(
+            total=3, backoff_factor=0.3, status_forcelist=[429, 500, 502, 503, 504]
+        ),
+    ),
+)
+
+# Non-capturing, long-form-first alternation: the sre engine tries branches
+# in order per position, so "Street" must come before "St" (etc.) and the
+# whole group shouldn't allocate a capture. The two PO Box spellings are
+# merged into one branch.
+STREET_KEYWORDS = re.compile(
+    r"\b(?:Street|St|Avenue|Ave|Road|Rd|Boulevard|Blvd|Drive|Dr|Lane|Ln"
+    r"|Suite|Ste|Unit|P\.?O\.?\s*Box|Postal)\b",
+    re.I,
+)
+US_ZIP_RE = re.compile(r"\b\d{5}(?:-\d{4})?\b")
+CA_POSTAL_RE = re.compile(r"\b[A-Za-z]\d[A-Za-z]\s?\d[A-Za-z]\d\b")
+WEBSITE_RE = re.compile(r"(https?://[^\s,]+)|(www\.[^\s,]+)", re.I)
+
+# --- geocode cache -----------------------------------------------------------
+#
+# Nominatim's 1 request/second politeness rule makes every cache miss cost at
+# least a second, so previously-resolved queries are kept in a small sqlite
+# table (normalized query -> lat/lon/provider/timestamp). A per-run dict memo
+# also remembers misses — per provider — so the variant cascade never re-asks
+# a provider the same string.
+
+_geo_conn = None
+_geo_pending = 0
+_GEO_MEMO = {}
+# Geocode workers share the connection and memo; sqlite connections are not
+# thread-safe on their own.
+_geo_lock = threading.Lock()
+
+
+def open_geocode_cache():
+    global _geo_conn
+    os.makedirs(os.path.dirname(GEOCODE_CACHE_DB), exist_ok=True)
+    _geo_conn = sqlite3.connect(GEOCODE_CACHE_DB, check_same_thread=False)
+    _geo_conn.execute("PRAGMA journal_mode=WAL")
+    _geo_conn.execute(
+        "CREATE TABLE IF NOT EXISTS geo"
+        " (q TEXT PRIMARY KEY, lat REAL, lon REAL, provider TEXT, ts REAL)"
+    )
+    _geo_conn.commit()
+
+
+def close_geocode_cache():
+    global _geo_conn
+    if _geo_conn is not None:
+        _geo_conn.commit()
+        _geo_conn.close()
+        _geo_conn = None
+
+
+def geocode_cache_get(q, provider):
+    """(lat, lon) for a previously-seen query, (None, None) for a known miss,
+    or None when the query has never been attempted.
+
+    The run memo is keyed by (provider, query): a Mapbox miss must not be
+    mistaken for a Nominatim miss or the fallback provider never gets asked.
+    Successes are shared across providers through the sqlite table, which is
+    keyed by query alone — coordinates are coordinates.
+    """
+    key = q.strip().lower()
+    with _geo_lock:
+        if (provider, key) in _GEO_MEMO:
+            return _GEO_MEMO[(provider, key)]
+        if _geo_conn is not None:
+            row = _geo_conn.execute("SELECT lat, lon FROM geo WHERE q=?", (key,)).fetchone()
+            if row:
+                _GEO_MEMO[(provider, key)] = (row[0], row[1])
+                return _GEO_MEMO[(provider, key)]
+    return None
+
+
+def geocode_cache_put(q, lat, lon, provider):
+    global _geo_pending
+    key = q.strip().lower()
+    with _geo_lock:
+        _GEO_MEMO[(provider, key)] = (lat, lon)
+        if lat is None or _geo_conn is None:
+            return  # misses stay in the run memo only
+        _geo_conn.execute(
+            "INSERT OR REPLACE INTO geo VALUES (?,?,?,?,?)",
+            (key, lat, lon, provider, time.time()),
+        )
+        _geo_pending += 1
+        if _geo_pending >= 32:
+            _geo_conn.commit()
+            _geo_pending = 0
+
+
+# -----------------------------------------------------------------------------
+
+
+def canonical_domain(url):
+    """Bare `example.com` for a URL-ish string, via urlsplit — no regexes."""
+    if not url:
+        return ""
+    u = url.strip()
+    if "://" not in u:
+        u = "http://" + u
+    host = urlsplit(u).netloc.lower()
+    return host.removeprefix("www.").split(":", 1)[0]
+
+
+def fetch_cards():
+    """All cards on the board, requesting only the fields this script reads.
+
+    labels and attachment previews were dropped from the payload (nothing
+    consumes them; the cover's scaled URLs already serve the logo path),
+    which shrinks the response substantially on image-heavy boards. Pages
+    of 1000 (Trello's max) keep very large boards working via `before`
+    cursoring.
+    """
+    cards = []
+    before = None
+    while True:
+        params = {
+            "key": TRELLO_KEY,
+            "token": TRELLO_TOKEN,
+            "fields": "name,desc,shortUrl,idMembers,cover",
+            "attachments": "true",
+            "attachment_fields": "url,mimeType",
+            "limit": 1000,
+        }
+        if before:
+            params["before"] = before
+        resp = SESSION.get(
+            f"https://api.trello.com/1/boards/{BOARD_ID}/cards", params=params, timeout=30
+        )
+        resp.raise_for_status()
+        page = orjson.loads(resp.content) if orjson is not None else resp.json()
+        cards.extend(page)
+        if len(page) < 1000:
+            return cards
+        before = min(c["id"] for c in page)
+
+
+# Cheap lowercase-substring triggers: a str containment test is an order of
+# magnitude cheaper than a regex search, and most description lines contain
+# none of these, so the regexes only ever see plausible lines.
+STREET_HINTS = (
+    " st", "street", " ave", "avenue", " rd", "road", "blvd", "drive", " dr",
+    "lane", " ln", "suite", "ste", "unit", "po box", "p.o.", "postal",
+)
+DIGIT_SET = frozenset("0123456789")
+
+# With pyahocorasick installed the street hints become a single automaton:
+# one C-level scan over the whole description replaces the per-line
+# per-substring containment loop.
+_STREET_AC = None
+if ahocorasick is not None:
+    _STREET_AC = ahocorasick.Automaton()
+    for _hint in STREET_HINTS:
+        _STREET_AC.add_word(_hint.strip(), _hint)
+    _STREET_AC.make_automaton()
+
+
+def _flagged_lines(lines):
+    """Indexes of lines containing a street hint, via one automaton pass."""
+    low_lines = [l.lower() for l in lines]
+    joined = "\n".join(low_lines)
+    starts = []
+    pos = 0
+    for l in low_lines:
+        starts.append(pos)
+        pos += len(l) + 1
+    flagged = set()
+    for end, _ in _STREET_AC.iter(joined):
+        flagged.add(bisect.bisect_right(starts, end) - 1)
+    return flagged
+
+
+def _maybe_ca_postal(ln):
+    """Any letter-digit-letter triplet present? (necessary for A1A 1A1)."""
+    for a, b, c in zip(ln, ln[1:], ln[2:]):
+        if a.isalpha() and b.isdigit() and c.isalpha():
+            return True
+    return False
+
+
+def extract_address_from_lines(lines):
+    """First of the (already stripped, non-empty) lines that looks like a
+    street address."""
+    flagged = _flagged_lines(lines) if _STREET_AC is not None else None
+    for i, ln in enumerate(lines):
+        if flagged is not None:
+            street_hit = i in flagged
+        else:
+            low = ln.lower()
+            street_hit = any(h in low for h in STREET_HINTS)
+        if street_hit and STREET_KEYWORDS.search(ln):
+            return ln
+        if sum(c in DIGIT_SET for c in ln) >= 5 and US_ZIP_RE.search(ln):
+            return ln
+        if _maybe_ca_postal(ln) and CA_POSTAL_RE.search(ln):
+            return ln
+    return ""
+
+
+class _NominatimGate:
+    """Enforces the Nominatim politeness gap (>=1.1 s) across all threads.
+
+    Sleeping while holding the lock is deliberate: concurrent callers queue
+    up and are released one per gap, which is exactly the 1 req/s rule. The
+    monotonic timestamp means a slow HTTP response counts toward the gap
+    instead of adding a blind sleep on top.
+    """
+
+    def __init__(self, min_gap=1.1):
+        self._min_gap = min_gap
+        self._lock = threading.Lock()
+        self._last = 0.0
+
+    def wait(self):
+        with self._lock:
+            now = time.monotonic()
+            delay = self._last + self._min_gap - now
+            if delay > 0:
+                time.sleep(delay)
+                now = time.monotonic()
+            self._last = now
+
+
+_NOMINATIM_GATE = _NominatimGate()
+
+
+def _structured_params(q):
+    """Nominatim structured parameters when `q` carries a recognizable postal
+    code; None means free-form only.
+
+    Structured street/postalcode lookups are both faster on Nominatim's side
+    and markedly more likely to hit on the first try, which keeps cards out
+    of the multi-variant cascade (each miss costs a politeness gap).
+    """
+    m = US_ZIP_RE.search(q)
+    country = "us"
+    if not m:
+        m = CA_POSTAL_RE.search(q)
+        country = "ca"
+    if not m:
+        return None
+    street = q[: m.start()].strip(" ,")
+    if not street:
+        return None
+    return {"street": street, "postalcode": m.group(0), "countrycodes": country}
+
+
+def _nominatim_request(params):
+    _NOMINATIM_GATE.wait()
+    try:
+        r = SESSION.get(NOMINATIM_URL, params=params, headers=NOMINATIM_HEADERS, timeout=20)
+        r.raise_for_status()
+        return r.json()
+    except (requests.RequestException, ValueError) as e:
+        log.warning("Nominatim failed for %r: %s", params, e)
+        return []
+
+
+def geocode_nominatim(q):
+    hit = geocode_cache_get(q, "nominatim")
+    if hit is not None:
+        return hit
+    base = {"format": "json", "limit": 1}
+    results = []
+    structured = _structured_params(q)
+    if structured is not None:
+        results = _nominatim_request({**base, **structured})
+    if not results:
+        results = _nominatim_request({**base, "q": q})
+    if results:
+        lat, lon = float(results[0]["lat"]), float(results[0]["lon"])
+        geocode_cache_put(q, lat, lon, "nominatim")
+        return lat, lon
+    geocode_cache_put(q, None, None, "nominatim")
+    return None, None
+
+
+def geocode_mapbox(q):
+    hit = geocode_cache_get(q, "mapbox")
+    if hit is not None:
+        return hit
+    try:
+        r = SESSION.get(
+            f"https://api.mapbox.com/geocoding/v5/mapbox.places/{requests.utils.quote(q)}.json",
+            params={"access_token": MAPBOX_TOKEN, "limit": 1},
+            timeout=20,
+        )
+        r.raise_for_status()
+        features = r.json().get("features", [])
+    except (requests.RequestException, ValueError) as e:
+        log.warning("Mapbox failed for '%s': %s", q, e)
+        features = []
+    if features:
+        lon, lat = features[0]["center"]
+        geocode_cache_put(q, lat, lon, "mapbox")
+        return lat, lon
+    geocode_cache_put(q, None, None, "mapbox")
+    return None, None
+
+
+# Provider order resolved once: Mapbox first when a token is configured,
+# Nominatim always as the free fallback.
+PROVIDERS = tuple(
+    fn for fn, ok in ((geocode_mapbox, bool(MAPBOX_TOKEN)), (geocode_nominatim, True)) if ok
+)
+
+
+def try_geocode_variants(name, address, domain):
+    """Cascade through query variants until one of the providers resolves.
+
+    Variants frequently collapse to the same string (a one-line address IS
+    its own last line), and each duplicate Nominatim attempt costs a 1.1 s
+    politeness gap — so the candidate list is built once and deduped on the
+    normalized query before any provider is asked.
+    """
+    last_line = address.splitlines()[-1] if address and "\n" in address else None
+    candidates = [
+        address or None,
+        last_line,
+        f"{name}, {address}" if name and address else None,
+        domain or None,
+    ]
+    seen = set()
+    for q in candidates:
+        if not q:
+            continue
+        norm = q.strip().lower()
+        if not norm or norm in seen:
+            continue
+        seen.add(norm)
+        for fn in PROVIDERS:
+            lat, lon = fn(q)
+            if lat is not None:
+                return lat, lon, q
+    return None, None, ""
+
+
+IMG_EXT_SET = frozenset({".png", ".jpg", ".jpeg", ".gif", ".webp"})
+
+
+def choose_cover_attachment(card):
+    """Best image URL for the card: explicit cover first, then attachments."""
+    cover = card.get("cover") or {}
+    scaled = cover.get("scaled") or []
+    if scaled:
+        return scaled[-1].get("url")
+    for a in card.get("attachments", []):
+        url = a.get("url") or ""
+        if not url:
+            continue
+        ext = os.path.splitext(urlparse(url).path)[1].lower()
+        if ext in IMG_EXT_SET or (a.get("mimeType") or "").startswith("image"):
+            return url
+    return None
+
+
+MAX_LOGO_BYTES = 8 << 20  # refuse covers larger than 8 MiB
+LOGO_MAX_AGE = 7 * 86400  # refetch covers at most weekly
+
+# Thumbnail encoding is the one CPU-bound step; main() stands up a small
+# process pool so resampling/PNG encoding doesn't block the download threads.
+_PROC_POOL = None
+
+
+def _encode_thumb(img_bytes):
+    """Original cover bytes -> 64x64 RGBA PNG bytes.
+
+    Runs in a worker process, so it must stay top-level and picklable and
+    touch nothing but its argument.
+    """
+    img = Image.open(BytesIO(img_bytes))
+    # Let libjpeg decode at a DCT-scaled 1/2..1/8 resolution: we only
+    # need 64px out of a multi-megapixel original.
+    img.draft("RGB", (128, 128))
+    img = img.convert("RGBA")
+    img.thumbnail((64, 64), Image.Resampling.LANCZOS)
+    canvas = Image.new("RGBA", (64, 64), (0, 0, 0, 0))
+    canvas.paste(img, ((64 - img.width) // 2, (64 - img.height) // 2))
+    out = BytesIO()
+    canvas.save(out, "PNG")
+    return out.getvalue()
+
+
+def download_and_save_image(url, card_id):
+    """Fetch the cover image and save a 64x64 PNG thumbnail; returns the path.
+
+    Trello covers almost never change, so a thumbnail younger than a week is
+    reused as-is — no GET, no Pillow work.
+    """
+    out_path = os.path.join(LOGO_DIR, f"{card_id}.png")
+    if os.path.exists(out_path) and time.time() - os.path.getmtime(out_path) < LOGO_MAX_AGE:
+        return out_path
+    try:
+        buf = BytesIO()
+        with SESSION.get(url, stream=True, timeout=30) as r:
+            r.raise_for_status()
+            total = 0
+            for chunk in r.iter_content(65536):
+                total += len(chunk)
+                if total > MAX_LOGO_BYTES:
+                    raise ValueError(f"cover image exceeds {MAX_LOGO_BYTES} bytes")
+                buf.write(chunk)
+        body = buf.getvalue()
+        if _PROC_POOL is not None:
+            png_bytes = _PROC_POOL.submit(_encode_thumb, body).result()
+        else:
+            png_bytes = _encode_thumb(body)
+        os.makedirs(LOGO_DIR, exist_ok=True)
+        with open(out_path, "wb") as f:
+            f.write(png_bytes)
+    except Exception as e:
+        log.warning("logo download failed for %s: %s", card_id, e)
+        return None
+    return out_path
+
+
+def extract_card(c):
+    """Cheap CPU-only extraction: everything about a card except network work."""
+    name = (c.get("name") or "").strip()
+    desc = c.get("desc") or ""
+
+    # Split/strip the description exactly once; address extraction and the
+    # last-line geocode fallback both work from the same list.
+    lines = [l for l in (s.strip() for s in desc.splitlines()) if l]
+    address = extract_address_from_lines(lines)
+
+    domain = ""
+    m = WEBSITE_RE.search(desc)
+    if m:
+        domain = canonical_domain(m.group(0))
+
+    return {
+        "card": c,
+        "name": name,
+        "desc": desc,
+        "last_line": lines[-1] if lines else "",
+        "address": address,
+        "domain": domain,
+        "cover_url": choose_cover_attachment(c),
+        "lat": None,
+        "lon": None,
+        "geocode_query": "",
+        "logo": None,
+    }
+
+
+def geocode_item(item):
+    lat, lon, used_query = try_geocode_variants(item["name"], item["address"], item["domain"])
+    if lat is None and item["last_line"]:
+        fallback = f"{item['name']}, {item['last_line']}"
+        lat, lon = geocode_nominatim(fallback)
+        if lat is not None:
+            used_query = fallback
+    return lat, lon, used_query
+
+
+def row_for(item, run_ts):
+    c = item["card"]
+    return {
+        "name": item["name"],
+        "address": item["address"],
+        "domain": item["domain"],
+        "lat": item["lat"],
+        "lon": item["lon"],
+        "geocode_query": item["geocode_query"],
+        "logo": item["logo"],
+        "trello_url": c.get("shortUrl", ""),
+        "updated_at": run_ts,
+    }
+
+
+def main():
+    global _PROC_POOL
+    open_geocode_cache()
+    # Capped at 4 workers: enough to keep PNG encoding off the download
+    # threads without thrashing alongside them.
+    _PROC_POOL = ProcessPoolExecutor(max_workers=min(os.cpu_count() or 1, 4))
+    try:
+        cards = fetch_cards()
+        total = len(cards)
+
+        # Phase 1: CPU-only extraction for every card.
+        items = [extract_card(c) for c in cards]
+
+        # Phase 2: geocoding across a pool. Cards resolved by cache or
+        # Mapbox overlap freely; the shared gate spaces actual Nominatim
+        # hits to one per 1.1 s regardless of worker count.
+        with ThreadPoolExecutor(max_workers=16) as ex:
+            futures = {ex.submit(geocode_item, item): item for item in items}
+            for i, fut in enumerate(as_completed(futures), 1):
+                item = futures[fut]
+                item["lat"], item["lon"], item["geocode_query"] = fut.result()
+                log.debug("[%d/%d] %s", i, total, item["name"])
+
+        # Phase 3: cover downloads are independent per card, so they overlap
+        # on a thread pool (requests releases the GIL around socket reads)
+        # instead of serializing behind the geocode cadence.
+        with ThreadPoolExecutor(max_workers=16) as ex:
+            futures = {}
+            for item in items:
+                if item["cover_url"]:
+                    card = item["card"]
+                    card_id = card.get("id") or card.get("shortUrl", "x")
+                    futures[ex.submit(download_and_save_image, item["cover_url"], card_id)] = item
+            for fut in as_completed(futures):
+                futures[fut]["logo"] = fut.result()
+
+        # Phase 4: assemble and write. All rows share one run timestamp —
+        # datetime.utcnow() per card allocated three throwaway objects each,
+        # and utcnow() is deprecated as of 3.12 anyway.
+        run_ts = datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+        rows = [row_for(item, run_ts) for item in items]
+        os.makedirs(os.path.dirname(OUT_JSON), exist_ok=True)
+        if orjson is not None:
+            payload = orjson.dumps(rows, option=orjson.OPT_INDENT_2)
+        else:
+            payload = json.dumps(rows, indent=2, ensure_ascii=False).encode("utf-8")
+        with open(OUT_JSON, "wb") as f:
+            f.write(payload)
+        log.info("Wrote %d clients to %s.", len(rows), OUT_JSON)
+    finally:
+        _PROC_POOL.shutdown()
+        _PROC_POOL = None
+        close_geocode_cache()
+        SESSION.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,572 @@
+#!/usr/bin/env python3
+"""Weekly lead assignment job.
+
+Reads the candidate CSV exported from research, filters out companies we
+have already pitched (prior Grok lists + assignment history), enriches each
+remaining candidate with a decision-maker contact from Apollo, scores fit,
+and appends the top 100 — split between Evan and Dave — to the shared
+Google Sheet. Also records the week's assignments in assignment_history.csv
+so re-runs are idempotent.
+
+Intended to be fired hourly by cron; `should_run_today_and_hour` gates the
+actual run to Monday mornings (Vancouver time, skipping BC holidays).
+"""
+
+import csv
+import functools
+import hashlib
+import os
+import sys
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timedelta
+from zoneinfo import ZoneInfo
+
+import numpy as np
+import pandas as pd
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# gspread/google-auth and holidays are imported lazily where used: they are
+# slow imports, and the common cron firing exits in should_run_today_and_hour
+# without ever needing the Sheets client.
+
+try:
+    import diskcache
+except ImportError:  # cache is an optimization, not a requirement
+    diskcache = None
+
+try:
+    import pyarrow  # noqa: F401  # multi-threaded CSV reader when available
+
+    # dtype=str on either engine: blank-celled numeric columns such as
+    # EmployeeCount would otherwise come back Arrow-typed with nulls, and
+    # the .fillna("") the pipeline relies on raises for those.
+    _CSV_ENGINE_KW = {"engine": "pyarrow", "dtype": str}
+except ImportError:
+    _CSV_ENGINE_KW = {"dtype": str}
+
+APOLLO_KEY = os.environ.get("APOLLO_API_KEY", "")
+SHEET_ID = os.environ.get("LEADS_SHEET_ID", "")
+GOOGLE_CREDS_JSON = os.environ.get("GOOGLE_CREDS_JSON", "creds/service_account.json")
+SCOPES = ["https://www.googleapis.com/auth/spreadsheets"]
+
+CANDIDATES_CSV = os.environ.get("CANDIDATES_CSV", "data/candidates.csv")
+ASSIGNMENT_HISTORY = os.environ.get("ASSIGNMENT_HISTORY", "data/assignment_history.csv")
+PRIOR_GROK_EVAN = "data/prior_grok_evan.csv"
+PRIOR_GROK_DAVE = "data/prior_grok_dave.csv"
+
+# Weeks are keyed by their Monday's date so WeekAssigned stays comparable
+# as a datetime when filtering recent assignments.
+_today = datetime.utcnow().date()
+WEEK_ASSIGNED = (_today - timedelta(days=_today.weekday())).isoformat()
+
+HISTORY_COLS = ["Domain", "CompanyName", "AssignedRep", "WeekAssigned", "LastDisposition"]
+
+SHEET_COLS = [
+    "CompanyName", "Website", "Domain", "HQ_City", "HQ_StateProvince", "Country",
+    "Industry", "EmployeeCount", "EstimatedFleetSize", "GrowthSignalScore", "FitScore",
+    "DM1_Name", "DM1_Title", "DM1_LinkedIn", "DM1_Email", "DM1_Email_Verified",
+    "DM1_DirectPhone", "DM1_Phone_Verified", "Source", "Notes",
+]
+SHEET_HEADER = SHEET_COLS + ["CallNotes", "AssignedRep", "WeekAssigned", "DateAdded"]
+
+# Only these candidate columns are ever consumed; skipping the rest at parse
+# time is pure savings.
+CANDIDATE_COLS = frozenset([
+    "Website", "Company", "CompanyName", "City", "State", "Country", "Industry",
+    "EmployeeCount", "EstimatedFleetSize", "GrowthSignalScore", "Source", "Notes",
+    "DM1_Name", "DM1_Title", "DM1_LinkedIn", "DM1_Email", "DM1_Email_Verified",
+    "DM1_DirectPhone", "DM1_Phone_Verified",
+])
+
+# Titles we want to reach, best first.
+TITLE_KEYWORDS = [
+    "fleet manager",
+    "fleet supervisor",
+    "director of operations",
+    "operations director",
+    "operations manager",
+    "logistics manager",
+    "transportation manager",
+    "maintenance manager",
+    "shop manager",
+    "vp operations",
+    "coo",
+    "general manager",
+    "owner",
+    "president",
+    "ceo",
+    "founder",
+]
+
+
+class TokenBucket:
+    """Thread-safe token bucket allowing `rate` acquisitions per `per` seconds."""
+
+    def __init__(self, rate, per):
+        self._rate = float(rate)
+        self._per = float(per)
+        self._allowance = float(rate)
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._allowance = min(
+                    self._rate,
+                    self._allowance + (now - self._last) * self._rate / self._per,
+                )
+                self._last = now
+                if self._allowance >= 1.0:
+                    self._allowance -= 1.0
+                    return
+                wait = (1.0 - self._allowance) * self._per / self._rate
+            time.sleep(wait)
+
+
+# Apollo allows bursts but we stay safely under 5 req/s across the pool.
+APOLLO_BUCKET = TokenBucket(rate=5, per=1.0)
+
+# One pooled session for all Apollo traffic: keeps sockets warm across the
+# thread pool and retries transient failures with backoff.
+APOLLO_HEADERS = {"Content-Type": "application/json", "Authorization": f"Bearer {APOLLO_KEY}"}
+SESSION = requests.Session()
+SESSION.mount(
+    "https://",
+    HTTPAdapter(
+        pool_connections=32,
+        pool_maxsize=32,
+        max_retries=Retry(
+            total=3, backoff_factor=0.5, status_forcelist=[429, 500, 502, 503, 504]
+        ),
+    ),
+)
+
+
+# Apollo responses rarely change week to week, so cache them on disk with a
+# monthly TTL. The cache key carries a short hash of the API key so rotating
+# the key invalidates stale entries.
+_APOLLO_CACHE = diskcache.Cache(".apollo_cache") if diskcache is not None else None
+_KEY_HASH = hashlib.sha1(APOLLO_KEY.encode()).hexdigest()[:8]
+APOLLO_CACHE_TTL = 60 * 60 * 24 * 30
+
+
+def apollo_cached(endpoint, normalize):
+    """Memoize an Apollo helper in-process (lru_cache) and in .apollo_cache.
+
+    `normalize` canonicalizes the lookup value so `https://x.com/`, `www.x.com`
+    and `x.com` share one entry. Empty results are cached too.
+    """
+
+    def deco(fn):
+        @functools.lru_cache(maxsize=None)
+        def lookup(norm):
+            key = f"{endpoint}:{_KEY_HASH}:{norm}"
+            if _APOLLO_CACHE is not None:
+                hit = _APOLLO_CACHE.get(key)
+                if hit is not None:
+                    return hit
+            result = fn(norm)
+            if _APOLLO_CACHE is not None:
+                _APOLLO_CACHE.set(key, result, expire=APOLLO_CACHE_TTL)
+            return result
+
+        @functools.wraps(fn)
+        def wrapper(value):
+            norm = normalize(value or "")
+            if not norm:
+                return []
+            return lookup(norm)
+
+        return wrapper
+
+    return deco
+
+
+_RE_SCHEME = re.compile(r"^https?://")
+_RE_WWW = re.compile(r"^www\.")
+
+
+def _present_cols(path, wanted):
+    """Intersection of a CSV's header with `wanted`, preserving file order.
+
+    The pyarrow engine only accepts list-like usecols, so resolve the
+    columns from the header line up front.
+    """
+    with open(path, newline="") as f:
+        header = next(csv.reader(f), [])
+    return [c for c in header if c in wanted]
+
+
+def canonical_domain(url):
+    """Normalize a website URL or bare domain to `example.com` form.
+
+    Pure slicing (no regex engine) on the hot scalar path, and the result is
+    interned: the same domain shows up across candidates, prior lists and
+    history, so set/dict lookups get to compare by pointer.
+    """
+    if not isinstance(url, str) or not url:
+        return ""
+    s = url.strip().lower()
+    if s.startswith("https://"):
+        s = s[8:]
+    elif s.startswith("http://"):
+        s = s[7:]
+    if s.startswith("www."):
+        s = s[4:]
+    i = len(s)
+    for ch in "/?#":
+        j = s.find(ch)
+        if 0 <= j < i:
+            i = j
+    return sys.intern(s[:i])
+
+
+def canonical_domain_series(s):
+    """Vectorized `canonical_domain` over a string Series (one C pass each)."""
+    return (
+        s.astype(str)
+        .str.strip()
+        .str.lower()
+        .str.replace(_RE_SCHEME, "", regex=True)
+        .str.replace(_RE_WWW, "", regex=True)
+        .str.split("/").str[0]
+        .str.split("?").str[0]
+    )
+
+
+def canonicalize_candidates(df):
+    """Normalize column names and derive the canonical Domain column."""
+    if "CompanyName" not in df.columns and "Company" in df.columns:
+        df = df.rename(columns={"Company": "CompanyName"})
+    df["Domain"] = canonical_domain_series(df["Website"].fillna(""))
+    return df
+
+
+def read_prior_domains():
+    """Union of domains from the prior Grok lead lists (already pitched)."""
+    domains = set()
+    for path in (PRIOR_GROK_EVAN, PRIOR_GROK_DAVE):
+        if not os.path.exists(path):
+            continue
+        cols = _present_cols(path, ("Website", "Domain"))
+        if not cols:
+            continue
+        pf = pd.read_csv(path, usecols=cols, **_CSV_ENGINE_KW).fillna("")
+        # Fold Website and Domain into one series so canonicalization runs
+        # in a single vectorized pass per file.
+        combined = pd.concat([pf[c] for c in cols], ignore_index=True)
+        domains.update(map(sys.intern, canonical_domain_series(combined).unique()))
+    domains.discard("")
+    return domains
+
+
+def load_assignment_history():
+    if not os.path.exists(ASSIGNMENT_HISTORY):
+        return pd.DataFrame(columns=HISTORY_COLS + ["domain"])
+    hist = pd.read_csv(ASSIGNMENT_HISTORY, **_CSV_ENGINE_KW).fillna("")
+    hist["domain"] = canonical_domain_series(hist["Domain"])
+    return hist
+
+
+def already_ran_for_week(week):
+    """True if assignment_history already contains rows for this ISO week."""
+    if not os.path.exists(ASSIGNMENT_HISTORY):
+        return False
+    with open(ASSIGNMENT_HISTORY, newline="") as f:
+        reader = csv.DictReader(f)
+        if "WeekAssigned" not in (reader.fieldnames or []):
+            return False
+        target = str(week).strip()
+        return any((r.get("WeekAssigned") or "").strip() == target for r in reader)
+
+
+# Built on first use and reused: holiday-rule computation is amortized
+# across calls, and two years is enough for any run near a year boundary.
+_BC_HOLIDAYS = None
+
+
+def should_run_today_and_hour():
+    """Gate to Monday 6am-7am Vancouver time, skipping BC stat holidays."""
+    global _BC_HOLIDAYS
+    now = datetime.now(ZoneInfo("America/Vancouver"))
+    if _BC_HOLIDAYS is None:
+        import holidays  # deferred: rule tables are slow to import
+
+        _BC_HOLIDAYS = holidays.CA(prov="BC", years=range(now.year, now.year + 2))
+    if now.date() in _BC_HOLIDAYS:
+        return False
+    return now.weekday() == 0 and now.hour == 6
+
+
+@apollo_cached("domain", canonical_domain)
+def apollo_people_by_domain(domain):
+    if not domain:
+        return []
+    APOLLO_BUCKET.acquire()
+    resp = SESSION.get(
+        "https://api.apollo.io/v1/mixed_people/search",
+        params={"q_organization_domains": domain, "per_page": 10},
+        headers=APOLLO_HEADERS,
+        timeout=15,
+    )
+    if resp.status_code != 200:
+        print(f"[WARN] Apollo domain search '{domain}': HTTP {resp.status_code}")
+        return []
+    return resp.json().get("people", [])
+
+
+@apollo_cached("company", lambda v: v.strip().lower())
+def apollo_people_by_company(company):
+    if not company:
+        return []
+    APOLLO_BUCKET.acquire()
+    resp = SESSION.get(
+        "https://api.apollo.io/v1/mixed_people/search",
+        params={"q_organization_name": company, "per_page": 10},
+        headers=APOLLO_HEADERS,
+        timeout=15,
+    )
+    if resp.status_code != 200:
+        print(f"[WARN] Apollo company search '{company}': HTTP {resp.status_code}")
+        return []
+    return resp.json().get("people", [])
+
+
+# One alternation over all title keywords, each in a named group so a match
+# maps straight back to its priority rank — one scan per title instead of a
+# keyword x person double loop.
+_TITLE_RE = re.compile(
+    "|".join(f"(?P<g{i}>{re.escape(k.lower())})" for i, k in enumerate(TITLE_KEYWORDS))
+)
+_FALLBACK_RE = re.compile(r"director|vp|vice|head|manager")
+
+
+def pick_decision_maker(people):
+    """Best person by title priority; loose fallback; else first result."""
+    best_rank = None
+    best_p = None
+    for p in people:
+        title = (p.get("title") or "").lower()
+        m = _TITLE_RE.search(title)
+        if m:
+            rank = next(i for i in range(len(TITLE_KEYWORDS)) if m.group(f"g{i}"))
+            if best_rank is None or rank < best_rank:
+                best_rank, best_p = rank, p
+                if rank == 0:
+                    break
+    if best_p:
+        return best_p
+    for p in people:
+        if _FALLBACK_RE.search((p.get("title") or "").lower()):
+            return p
+    return people[0] if people else None
+
+
+_INDUSTRY_RE = re.compile(r"fleet|transport|logistics|trucking|delivery|distribution")
+
+
+def compute_fit_score_vec(df):
+    """FitScore for every row at once: boolean masks + integer arithmetic.
+
+    Same scoring as the old per-row function (industry 30, employee-count
+    tier 25/10/5, contact completeness 30/10, capped at 100) but one NumPy
+    pass instead of an axis=1 apply.
+    """
+    ind = df["Industry"].fillna("").str.lower()
+    industry_mask = ind.str.contains(_INDUSTRY_RE, na=False)
+    emp = pd.to_numeric(df["EmployeeCount"], errors="coerce")
+    emp_score = np.where(emp >= 100, 25, np.where(emp >= 50, 10, np.where(emp.isna(), 5, 0)))
+    has_email = df["DM1_Email"].astype(bool)
+    has_phone = df["DM1_DirectPhone"].astype(bool)
+    contact_score = np.where(has_email & has_phone, 30, np.where(has_email | has_phone, 10, 0))
+    return np.minimum(100, industry_mask.astype(int) * 30 + emp_score + contact_score).astype(int)
+
+
+# Fixed set of enrichment output columns (FitScore is computed afterwards).
+ROW_KEYS = [c for c in SHEET_COLS if c != "FitScore"]
+
+
+def base_row(r):
+    """Output row for a candidate before any enrichment fields are filled."""
+    return {
+        "CompanyName": r.get("CompanyName", ""),
+        "Website": r.get("Website", ""),
+        "Domain": r.get("Domain", ""),
+        "HQ_City": r.get("City", ""),
+        "HQ_StateProvince": r.get("State", ""),
+        "Country": r.get("Country", ""),
+        "Industry": r.get("Industry", ""),
+        "EmployeeCount": r.get("EmployeeCount", ""),
+        "EstimatedFleetSize": r.get("EstimatedFleetSize", ""),
+        "GrowthSignalScore": r.get("GrowthSignalScore", ""),
+        "DM1_Name": "",
+        "DM1_Title": "",
+        "DM1_LinkedIn": "",
+        "DM1_Email": "",
+        "DM1_Email_Verified": "",
+        "DM1_DirectPhone": "",
+        "DM1_Phone_Verified": "",
+        "Source": r.get("Source", ""),
+        "Notes": r.get("Notes", ""),
+    }
+
+
+def enrich_one(r):
+    """Enrich a single candidate row with a decision-maker from Apollo."""
+    domain = r.get("Domain", "")
+    company = r.get("CompanyName", "")
+    row = base_row(r)
+    # Nothing to look up by — don't spend a thread-pool slot on two no-op
+    # Apollo calls.
+    if not domain and not company:
+        return row
+    # Research sometimes ships a contact with the candidate; trust it and
+    # skip the remote lookup entirely.
+    if r.get("DM1_Email") and r.get("DM1_Name"):
+        for field in ("DM1_Name", "DM1_Title", "DM1_LinkedIn", "DM1_Email",
+                      "DM1_Email_Verified", "DM1_DirectPhone", "DM1_Phone_Verified"):
+            row[field] = r.get(field, "")
+        return row
+    try:
+        people = apollo_people_by_domain(domain)
+        if not people:
+            people = apollo_people_by_company(company)
+    except requests.RequestException as e:
+        print(f"[WARN] Apollo lookup failed for '{company}' ({domain}): {e}")
+        people = []
+    dm = pick_decision_maker(people)
+    if dm:
+        row["DM1_Name"] = dm.get("name", "")
+        row["DM1_Title"] = dm.get("title", "")
+        row["DM1_LinkedIn"] = dm.get("linkedin_url", "")
+        row["DM1_Email"] = dm.get("email", "")
+        row["DM1_Email_Verified"] = "yes" if dm.get("email_status") == "verified" else ""
+        row["DM1_DirectPhone"] = dm.get("phone", "") or dm.get("sanitized_phone", "")
+    return row
+
+
+def to_sheet_rows(df_block, rep):
+    """Pack a rep's block into sheet rows via one values.tolist(), no iterrows."""
+    out = df_block.copy()
+    for c in SHEET_COLS:
+        if c not in out.columns:
+            out[c] = ""
+    out = out[SHEET_COLS]
+    out["FitScore"] = pd.to_numeric(out["FitScore"], errors="coerce").fillna(0).astype(int)
+    today = datetime.utcnow().strftime("%Y-%m-%d")
+    return [row + ["", rep, WEEK_ASSIGNED, today] for row in out.values.tolist()]
+
+
+def append_weekly_blocks(blocks):
+    """Append every tab's weekly block in a single values.batchUpdate.
+
+    `blocks` maps worksheet title -> data rows. Each tab's full block
+    (week banner, header row, data, trailing blank) is assembled in memory;
+    the start row is found with one values.get on column A per tab, then
+    all tabs go out in one batch call instead of four appends per tab.
+    """
+    import gspread  # deferred: pulls in google-auth and friends
+    from google.oauth2.service_account import Credentials
+
+    creds = Credentials.from_service_account_file(GOOGLE_CREDS_JSON, scopes=SCOPES)
+    sh = gspread.authorize(creds).open_by_key(SHEET_ID)
+    today = datetime.utcnow().strftime("%Y-%m-%d")
+    data = []
+    for tab, rows in blocks.items():
+        block = [[f"Week: {today}"], SHEET_HEADER, *rows, [""]]
+        col_a = sh.values_get(f"{tab}!A:A").get("values", [])
+        start = len(col_a) + 1
+        data.append({"range": f"{tab}!A{start}", "majorDimension": "ROWS", "values": block})
+    sh.values_batch_update(body={"valueInputOption": "USER_ENTERED", "data": data})
+
+
+def main():
+    if not should_run_today_and_hour():
+        print("Outside the Monday-morning run window; nothing to do.")
+        return
+    if already_ran_for_week(WEEK_ASSIGNED):
+        print(f"Assignments for {WEEK_ASSIGNED} already exist; nothing to do.")
+        return
+
+    df = pd.read_csv(
+        CANDIDATES_CSV, usecols=_present_cols(CANDIDATES_CSV, CANDIDATE_COLS), **_CSV_ENGINE_KW
+    ).fillna("")
+    df = canonicalize_candidates(df)
+
+    history_df = load_assignment_history()
+    # Domains assigned within the last 12 months, as a set: one pass over the
+    # history instead of a per-candidate boolean scan.
+    cutoff = datetime.utcnow() - timedelta(days=365)
+    hist_dt = pd.to_datetime(history_df["WeekAssigned"], errors="coerce")
+    recent_domains = set(
+        map(sys.intern, history_df.loc[hist_dt >= cutoff, "domain"].dropna().unique())
+    )
+    recent_domains.discard("")
+
+    # Filter and dedupe BEFORE enrichment so Apollo never sees a row that
+    # would be dropped afterwards — every duplicate removed here is an HTTP
+    # call (and API quota) saved.
+    prior_domains = read_prior_domains()
+    df = df[~df["Domain"].isin(prior_domains)]
+    df = df[~df["Domain"].isin(recent_domains)]
+    # Company-only candidates have no Domain; dedupe those on CompanyName so
+    # a blank domain doesn't collapse them all into one row.
+    has_domain = df["Domain"] != ""
+    df = pd.concat(
+        [
+            df[has_domain].drop_duplicates(subset=["Domain"], keep="first"),
+            df[~has_domain].drop_duplicates(subset=["CompanyName"], keep="first"),
+        ]
+    ).sort_index().reset_index(drop=True)
+    print(f"{len(df)} candidates after prior-list, recency and dedupe filters.")
+
+    # Fan the Apollo lookups out across a bounded pool; the shared token
+    # bucket inside the helpers keeps us under the API rate limit. Results
+    # are collected by original position so ordering stays deterministic.
+    enriched = [None] * len(df)
+    with ThreadPoolExecutor(max_workers=16) as ex:
+        futures = {ex.submit(enrich_one, r): idx for idx, r in df.iterrows()}
+        for fut in as_completed(futures):
+            idx = futures[fut]
+            try:
+                enriched[idx] = fut.result()
+            except Exception as e:
+                print(f"[WARN] enrichment failed for row {idx}: {e}")
+                enriched[idx] = base_row(df.loc[idx])
+    enriched = [r for r in enriched if r is not None]
+
+    # Columnar (SoA) construction: homogeneous per-column lists give the
+    # frame typed contiguous arrays from the start, instead of pandas
+    # inferring them from a list of dicts.
+    df_en = pd.DataFrame({k: [r.get(k, "") for r in enriched] for k in ROW_KEYS})
+    df_en["FitScore"] = compute_fit_score_vec(df_en)
+
+    df_en = df_en.sort_values("FitScore", ascending=False)
+    top100 = df_en.head(100).reset_index(drop=True).copy()
+    top100["AssignedRep"] = ["Evan" if i % 2 == 0 else "Dave" for i in range(len(top100))]
+    evan = top100[top100["AssignedRep"] == "Evan"]
+    dave = top100[top100["AssignedRep"] == "Dave"]
+
+    append_weekly_blocks(
+        {"Evan": to_sheet_rows(evan, "Evan"), "Dave": to_sheet_rows(dave, "Dave")}
+    )
+
+    # Append only the new rows; rewriting the whole history would cost
+    # O(total history) per run for a 100-row addition.
+    new_rows = top100[["Domain", "CompanyName", "AssignedRep"]].assign(
+        WeekAssigned=WEEK_ASSIGNED, LastDisposition=""
+    )
+    header = not os.path.exists(ASSIGNMENT_HISTORY)
+    new_rows.to_csv(ASSIGNMENT_HISTORY, mode="a", header=header, index=False)
+    print(f"Assigned {len(top100)} leads for {WEEK_ASSIGNED}.")
+
+
+if __name__ == "__main__":
+    main()